@@ -3,10 +3,17 @@ Smaz compression library for compressing small strings.
 Based on the original smaz library by antirez.
 """
 
-from typing import Dict, List, Optional, Union
+from array import array
+from typing import BinaryIO, Dict, List, Optional, TextIO, Tuple, Union
+import collections
+import contextlib
+import functools
+import io
+import re
 import sys
 import argparse
 import os
+import tempfile
 
 # Compression codebook (same as in Go and PHP versions)
 CODES = [
@@ -34,25 +41,115 @@ CODES = [
 ]
 
 # Build encode and decode lookup tables
-ENCODE_MAP: Dict[str, int] = {s: i for i, s in enumerate(CODES)}
+ENCODE_MAP: Dict[bytes, int] = {s.encode('latin-1'): i for i, s in enumerate(CODES)}
 DECODE_MAP: List[str] = CODES
+DECODE_BYTES: List[bytes] = [s.encode('latin-1') for s in CODES]
+
+
+def _build_trie(encode_map: Dict[bytes, int]) -> Tuple[array, List[int]]:
+    """
+    Build a byte trie over the codebook for longest-match scanning.
+    
+    Args:
+        encode_map: Mapping of codebook entries to their codes
+        
+    Returns:
+        A flat goto table where ``goto[node * 256 + byte]`` is the child
+        node (0 meaning no child), and a list giving the code that ends
+        at each node (-1 if none)
+    """
+    goto = array('H', bytes(2 * 256))
+    code_at_node = [-1]
+    
+    for key, code in encode_map.items():
+        node = 0
+        for byte in key:
+            child = goto[node * 256 + byte]
+            if not child:
+                child = len(code_at_node)
+                code_at_node.append(-1)
+                goto.extend(array('H', bytes(2 * 256)))
+                goto[node * 256 + byte] = child
+            node = child
+        code_at_node[node] = code
+    
+    return goto, code_at_node
+
+
+# Trie for longest-match scanning during compression
+TRIE_GOTO, TRIE_CODES = _build_trie(ENCODE_MAP)
+
+# Matches any byte that starts at least one code (a child of the trie root)
+CODE_START_PATTERN = re.compile(
+    b'[' + b''.join(re.escape(bytes([b])) for b in range(256) if TRIE_GOTO[b]) + b']'
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _build_automaton() -> Tuple[array, List[Tuple[Tuple[int, int], ...]]]:
+    """
+    Build an Aho-Corasick automaton over the codebook trie.
+    
+    The automaton is only needed by compress_optimal(), so it is built on
+    first use rather than at import.
+    
+    Returns:
+        A flat DFA transition table where ``delta[state * 256 + byte]`` is
+        the next state (failure links already folded in), and for each
+        state the ``(code, length)`` pairs of every code ending there
+    """
+    delta = array('H', TRIE_GOTO)
+    fail = [0] * len(TRIE_CODES)
+    depth = [0] * len(TRIE_CODES)
+    outputs: List[Tuple[Tuple[int, int], ...]] = [()] * len(TRIE_CODES)
+    
+    # Breadth-first, so every failure target is complete before it is used
+    queue = [0]
+    for node in queue:
+        row = node * 256
+        fail_row = fail[node] * 256
+        for byte in range(256):
+            child = TRIE_GOTO[row + byte]
+            if not child:
+                if node:
+                    delta[row + byte] = delta[fail_row + byte]
+                continue
+            
+            fail[child] = delta[fail_row + byte] if node else 0
+            depth[child] = depth[node] + 1
+            code = TRIE_CODES[child]
+            own = ((code, depth[child]),) if code >= 0 else ()
+            outputs[child] = own + outputs[fail[child]]
+            queue.append(child)
+    
+    return delta, outputs
+
 
 # Special codes
 VERBATIM_BYTE = 254  # Code for a single verbatim byte
 VERBATIM_STRING = 255  # Code for a verbatim string followed by length
 
+# Matches either verbatim code, to find the end of a run of codebook codes
+VERBATIM_PATTERN = re.compile(b'[\xfe\xff]')
+
+# Inputs shorter than this take a plain loop, which is cheaper than
+# setting up the bulk scanning paths for them
+SHORT_INPUT_LEN = 64
+
 
 class SmazError(Exception):
     """Exception raised for Smaz compression/decompression errors."""
     pass
 
 
-def compress(data: Union[str, bytes]) -> bytes:
+def compress(data: Union[str, bytes], optimal: bool = False) -> bytes:
     """
     Compress a string or bytes using the Smaz algorithm.
     
     Args:
         data: Input string or bytes to compress
+        optimal: Choose the smallest possible encoding instead of greedily
+            taking the longest code at each position (slower)
         
     Returns:
         Compressed bytes
@@ -67,51 +164,295 @@ def compress(data: Union[str, bytes]) -> bytes:
     else:
         raise TypeError("Input must be str or bytes")
     
+    if optimal:
+        return _compress_optimal_block(input_bytes, True)[0]
+    if len(input_bytes) < SHORT_INPUT_LEN:
+        return _compress_short(input_bytes)
+    return _compress_block(input_bytes, True)[0]
+
+
+def _compress_short(input_bytes: bytes) -> bytes:
+    """
+    Compress a short input with a plain trie scan.
+    
+    Produces the same output as _compress_block() for a final block,
+    without its buffer preallocation or run skipping.
+    
+    Args:
+        input_bytes: Input bytes to compress
+        
+    Returns:
+        Compressed bytes
+    """
     output = bytearray()
-    verbatim = bytearray()
+    verbatim_start = 0
     i = 0
     input_len = len(input_bytes)
     
     while i < input_len:
-        # Try to find the longest matching code (max length 7)
-        matched = False
-        max_len = min(7, input_len - i)
-        
-        for j in range(max_len, 0, -1):
-            chunk = input_bytes[i:i+j].decode('latin-1')
-            if chunk in ENCODE_MAP:
-                # Flush any pending verbatim data
-                if verbatim:
-                    output.extend(_flush_verbatim(verbatim))
-                    verbatim.clear()
-                
-                # Write the code
-                output.append(ENCODE_MAP[chunk])
-                i += j
-                matched = True
+        # Walk the trie to find the longest matching code
+        code = -1
+        node = 0
+        j = i
+        while j < input_len:
+            node = TRIE_GOTO[node * 256 + input_bytes[j]]
+            if not node:
                 break
+            j += 1
+            if TRIE_CODES[node] >= 0:
+                code = TRIE_CODES[node]
+                length = j - i
         
-        if not matched:
-            # No match found, add to verbatim buffer
-            verbatim.append(input_bytes[i])
-            i += 1
+        if code >= 0:
+            # Flush any pending verbatim data; short inputs never need
+            # more than one chunk
+            verbatim_len = i - verbatim_start
+            if verbatim_len == 1:
+                output.append(VERBATIM_BYTE)
+                output.append(input_bytes[verbatim_start])
+            elif verbatim_len:
+                output.append(VERBATIM_STRING)
+                output.append(verbatim_len)
+                output += input_bytes[verbatim_start:i]
             
-            # If verbatim buffer is full, flush it
-            if len(verbatim) == 255:
-                output.extend(_flush_verbatim(verbatim))
-                verbatim.clear()
+            # Write the code
+            output.append(code)
+            i += length
+            verbatim_start = i
+        else:
+            i += 1
     
     # Flush any remaining verbatim data
-    if verbatim:
-        output.extend(_flush_verbatim(verbatim))
+    verbatim_len = input_len - verbatim_start
+    if verbatim_len == 1:
+        output.append(VERBATIM_BYTE)
+        output.append(input_bytes[verbatim_start])
+    elif verbatim_len:
+        output.append(VERBATIM_STRING)
+        output.append(verbatim_len)
+        output += input_bytes[verbatim_start:]
     
     return bytes(output)
 
 
-def decompress(data: bytes) -> bytes:
+def _compress_block(input_bytes: bytes, final: bool) -> Tuple[bytes, int]:
+    """
+    Compress as much of a block of input as can be decided.
+    
+    Args:
+        input_bytes: Input bytes to compress
+        final: Whether no more input follows this block
+        
+    Returns:
+        The compressed bytes and the number of input bytes they cover.
+        For a final block this is the whole input; otherwise positions
+        without a full code's worth of lookahead, and any pending
+        verbatim run shorter than a full 255-byte chunk, are left for
+        the next block so the output matches a one-shot compress.
+    """
+    input_len = len(input_bytes)
+    
+    # Positions that can still see the longest code (7 bytes) are final
+    scan_len = input_len if final else input_len - 6
+    
+    # Every input byte costs at most two output bytes (a lone verbatim
+    # byte), so the output never outgrows this buffer
+    output = bytearray(2 * input_len + 2)
+    o = 0
+    verbatim_start = 0
+    i = 0
+    
+    # Verbatim runs are copied out of a view, without an intermediate
+    # bytes slice
+    view = memoryview(input_bytes)
+    
+    # Bind the hot tables and methods to locals for the scan loop
+    goto = TRIE_GOTO
+    code_at_node = TRIE_CODES
+    find_code_start = CODE_START_PATTERN.search
+    
+    while i < scan_len:
+        if not goto[input_bytes[i]]:
+            # No code starts with this byte, so skip the whole run of such
+            # bytes into the pending verbatim data
+            match = find_code_start(input_bytes, i + 1)
+            i = match.start() if match else input_len
+            continue
+        
+        # Walk the trie to find the longest matching code
+        code = -1
+        length = 0
+        node = 0
+        j = i
+        while j < input_len:
+            node = goto[node * 256 + input_bytes[j]]
+            if not node:
+                break
+            j += 1
+            if code_at_node[node] >= 0:
+                code = code_at_node[node]
+                length = j - i
+        
+        if code >= 0:
+            # Flush any pending verbatim data, inlined for runs that fit
+            # in a single verbatim chunk
+            verbatim_len = i - verbatim_start
+            if verbatim_len == 1:
+                output[o] = VERBATIM_BYTE
+                output[o + 1] = input_bytes[verbatim_start]
+                o += 2
+            elif verbatim_len and verbatim_len <= 255:
+                output[o] = VERBATIM_STRING
+                output[o + 1] = verbatim_len
+                output[o + 2:o + 2 + verbatim_len] = view[verbatim_start:i]
+                o += 2 + verbatim_len
+            elif verbatim_len:
+                o = _flush_verbatim_into(output, o, view[verbatim_start:i])
+            
+            # Write the code
+            output[o] = code
+            o += 1
+            i += length
+            verbatim_start = i
+        else:
+            # No match found, leave the byte in the pending verbatim run
+            i += 1
+    
+    # Flush any remaining verbatim data, keeping back a partial chunk if
+    # more input may extend the run
+    if final:
+        consumed = input_len
+    else:
+        consumed = verbatim_start + (i - verbatim_start) // 255 * 255
+    if verbatim_start < consumed:
+        o = _flush_verbatim_into(output, o, view[verbatim_start:consumed])
+    
+    del output[o:]
+    return bytes(output), consumed
+
+
+def _compress_optimal_block(input_bytes: bytes, final: bool) -> Tuple[bytes, int]:
+    """
+    Compress a block of input to the smallest possible Smaz encoding.
+    
+    Instead of greedily taking the longest code at each position, every
+    code occurrence is found with the Aho-Corasick automaton and the
+    cheapest parse into codes and verbatim runs is chosen by dynamic
+    programming. The output is never larger than the greedy one and
+    decompresses with the regular decompress().
+    
+    Args:
+        input_bytes: Input bytes to compress
+        final: Whether no more input follows this block
+        
+    Returns:
+        The compressed bytes and the number of input bytes they cover.
+        For a final block this is the whole input; otherwise the parse
+        is cut at its last token boundary at least 6 bytes before the
+        end, so no code that could continue into the next block is lost.
+    """
+    delta, outputs = _build_automaton()
+    input_len = len(input_bytes)
+    
+    # cost[i] is the smallest output size for input_bytes[:i], and
+    # back[i] the start of the last token, with code[i] its code or -1
+    # for a verbatim run
+    cost = [0] * (input_len + 1)
+    back = [0] * (input_len + 1)
+    code_at = [-1] * (input_len + 1)
+    
+    # Verbatim runs of 2..255 bytes cost their length plus a 2-byte
+    # header, so the best run ending at i starts at the k in that window
+    # with the smallest cost[k] - k, kept in a monotonic queue
+    window: collections.deque = collections.deque()
+    state = 0
+    
+    for i in range(1, input_len + 1):
+        # A single verbatim byte costs two bytes
+        best = cost[i - 1] + 2
+        start = i - 1
+        code = -1
+        
+        k = i - 2
+        if k >= 0:
+            key = cost[k] - k
+            while window and cost[window[-1]] - window[-1] >= key:
+                window.pop()
+            window.append(k)
+        while window and window[0] < i - 255:
+            window.popleft()
+        if window:
+            k = window[0]
+            run_cost = cost[k] + (i - k) + 2
+            if run_cost < best:
+                best = run_cost
+                start = k
+        
+        # Every code ending at i costs one byte
+        state = delta[state * 256 + input_bytes[i - 1]]
+        for match_code, length in outputs[state]:
+            if cost[i - length] + 1 <= best:
+                best = cost[i - length] + 1
+                start = i - length
+                code = match_code
+        
+        cost[i] = best
+        back[i] = start
+        code_at[i] = code
+    
+    # Keep back the tail after the last token boundary that leaves the
+    # longest code (7 bytes) fully visible before the end of the block
+    consumed = input_len
+    if not final:
+        while consumed > 0 and consumed > input_len - 6:
+            consumed = back[consumed]
+    
+    # Walk the chosen parse backwards, then emit it in order
+    tokens = []
+    i = consumed
+    while i > 0:
+        tokens.append((back[i], i, code_at[i]))
+        i = back[i]
+    
+    output = bytearray(cost[consumed])
+    o = 0
+    view = memoryview(input_bytes)
+    for start, end, code in reversed(tokens):
+        if code >= 0:
+            output[o] = code
+            o += 1
+        else:
+            o = _flush_verbatim_into(output, o, view[start:end])
+    
+    return bytes(output), consumed
+
+
+def decompress(data: Union[bytes, bytearray, memoryview]) -> bytes:
     """
     Decompress Smaz-compressed data.
     
+    Args:
+        data: Compressed bytes, or any other bytes-like object, which is
+            read in place without being copied
+        
+    Returns:
+        Decompressed bytes
+        
+    Raises:
+        SmazError: If the compressed data is invalid or corrupted
+    """
+    if not isinstance(data, (bytes, bytearray)):
+        # View other buffers (array, mmap, memoryview) as raw bytes
+        data = memoryview(data).cast('B')
+    if len(data) < SHORT_INPUT_LEN:
+        return _decompress_short(data)
+    return _decompress_block(data, True)[0]
+
+
+def _decompress_short(data: Union[bytes, bytearray, memoryview]) -> bytes:
+    """
+    Decompress short data one code at a time.
+    
     Args:
         data: Compressed bytes
         
@@ -125,12 +466,67 @@ def decompress(data: bytes) -> bytes:
     i = 0
     data_len = len(data)
     
+    while i < data_len:
+        code = data[i]
+        
+        if code < VERBATIM_BYTE:
+            output += DECODE_BYTES[code]
+            i += 1
+            
+        elif code == VERBATIM_BYTE:
+            # Single verbatim byte
+            if i + 1 >= data_len:
+                raise SmazError("Incomplete verbatim byte sequence")
+            output.append(data[i + 1])
+            i += 2
+            
+        else:
+            # Verbatim string with length
+            if i + 1 >= data_len:
+                raise SmazError("Incomplete verbatim string length")
+            
+            length = data[i + 1]
+            if i + 2 + length > data_len:
+                raise SmazError("Incomplete verbatim string data")
+            
+            output += data[i+2:i+2+length]
+            i += 2 + length
+    
+    return bytes(output)
+
+
+def _decompress_block(data: Union[bytes, bytearray, memoryview],
+                      final: bool) -> Tuple[bytes, int]:
+    """
+    Decompress the complete codes at the start of a block of data.
+    
+    Args:
+        data: Compressed bytes
+        final: Whether no more data follows this block
+        
+    Returns:
+        The decompressed bytes and the number of input bytes consumed.
+        A truncated verbatim sequence at the end of a non-final block is
+        left unconsumed for the next block.
+        
+    Raises:
+        SmazError: If a final block ends with a truncated sequence
+    """
+    output = bytearray()
+    i = 0
+    data_len = len(data)
+    
+    decode = DECODE_BYTES.__getitem__
+    find_verbatim = VERBATIM_PATTERN.search
+    
     while i < data_len:
         code = data[i]
         
         if code == VERBATIM_BYTE:
             # Single verbatim byte
             if i + 1 >= data_len:
+                if not final:
+                    break
                 raise SmazError("Incomplete verbatim byte sequence")
             output.append(data[i + 1])
             i += 2
@@ -138,58 +534,63 @@ def decompress(data: bytes) -> bytes:
         elif code == VERBATIM_STRING:
             # Verbatim string with length
             if i + 1 >= data_len:
+                if not final:
+                    break
                 raise SmazError("Incomplete verbatim string length")
             
             length = data[i + 1]
             if i + 2 + length > data_len:
+                if not final:
+                    break
                 raise SmazError("Incomplete verbatim string data")
             
-            output.extend(data[i+2:i+2+length])
+            output += data[i+2:i+2+length]
             i += 2 + length
             
         else:
-            # Look up code in decode map
-            if code >= len(DECODE_MAP):
-                raise SmazError(f"Invalid code: {code}")
-            
-            output.extend(DECODE_MAP[code].encode('latin-1'))
-            i += 1
+            # Decode the whole run of codebook codes up to the next
+            # verbatim code at once; every byte below 254 is a valid code
+            match = find_verbatim(data, i)
+            end = match.start() if match else data_len
+            output += b''.join(map(decode, data[i:end]))
+            i = end
     
-    return bytes(output)
+    return bytes(output), i
 
 
-def _flush_verbatim(verbatim: bytearray) -> bytearray:
+def _flush_verbatim_into(output: bytearray, o: int,
+                         verbatim: Union[bytes, bytearray, memoryview]) -> int:
     """
-    Flush verbatim buffer to output format.
+    Write verbatim bytes with their headers straight into an output buffer.
     
     Args:
+        output: Buffer to write into, at least large enough for the result
+        o: Index in the buffer to start writing at
         verbatim: Verbatim bytes to flush
         
     Returns:
-        Formatted verbatim bytes with appropriate headers
+        The index just past the written data
     """
-    output = bytearray()
     length = len(verbatim)
     
-    if length == 0:
-        return output
-    
     # Process in chunks of up to 255 bytes
     pos = 0
     while pos < length:
         chunk_size = min(255, length - pos)
-        chunk = verbatim[pos:pos+chunk_size]
         
         if chunk_size == 1:
-            output.append(VERBATIM_BYTE)
+            output[o] = VERBATIM_BYTE
+            o += 1
         else:
-            output.append(VERBATIM_STRING)
-            output.append(chunk_size)
+            output[o] = VERBATIM_STRING
+            output[o + 1] = chunk_size
+            o += 2
         
-        output.extend(chunk)
+        output[o:o + chunk_size] = verbatim[pos:pos+chunk_size]
+        o += chunk_size
         pos += chunk_size
     
-    return output
+    return o
 
 
 # Convenience functions
@@ -198,11 +599,84 @@ def compress_str(s: str) -> bytes:
     return compress(s)
 
 
+def compress_optimal(data: Union[str, bytes]) -> bytes:
+    """Compress a string or bytes to the smallest possible encoding."""
+    return compress(data, optimal=True)
+
+
 def decompress_str(data: bytes) -> str:
     """Decompress bytes to a string (assumes UTF-8 encoding)."""
     return decompress(data).decode('utf-8')
 
 
+def compress_stream(fin: Union[BinaryIO, TextIO], fout: BinaryIO,
+                    buf_size: int = 65536, optimal: bool = False) -> None:
+    """
+    Compress a stream chunk by chunk without reading it all into memory.
+    
+    The greedy output is identical to compressing the whole input at once.
+    With optimal, each block's parse is fixed before the next chunk is
+    read, so the output can be slightly larger than a one-shot
+    compress(optimal=True), by a few bytes per chunk at most.
+    
+    Args:
+        fin: Readable stream of bytes (text streams are encoded as UTF-8)
+        fout: Writable binary stream for the compressed data
+        buf_size: Number of bytes or characters to read at a time
+        optimal: Choose the smallest encoding per block (see compress)
+    """
+    carry = b''
+    while True:
+        chunk = fin.read(buf_size)
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        
+        final = not chunk
+        block = carry + chunk
+        if optimal:
+            output, consumed = _compress_optimal_block(block, final)
+        else:
+            output, consumed = _compress_block(block, final)
+        fout.write(output)
+        
+        if final:
+            break
+        carry = block[consumed:]
+
+
+def decompress_stream(fin: BinaryIO, fout: BinaryIO, buf_size: int = 65536) -> None:
+    """
+    Decompress a stream chunk by chunk without reading it all into memory.
+    
+    Args:
+        fin: Readable binary stream of compressed data
+        fout: Writable binary stream for the decompressed data
+        buf_size: Number of bytes to read at a time
+        
+    Raises:
+        SmazError: If the compressed data is invalid or corrupted
+    """
+    carry = b''
+    while True:
+        chunk = fin.read(buf_size)
+        
+        final = not chunk
+        block = carry + chunk
+        output, consumed = _decompress_block(block, final)
+        fout.write(output)
+        
+        if final:
+            break
+        carry = block[consumed:]
+
+
+def _replaceable_file(path: str) -> bool:
+    """Whether path is a plain file that is safe to replace by renaming."""
+    if os.path.islink(path) or not os.path.isfile(path):
+        return False
+    return os.stat(path).st_nlink == 1
+
+
 def main():
     """CLI entry point."""
     parser = argparse.ArgumentParser(
@@ -231,68 +705,77 @@ def main():
         help='Read input from file'
     )
     
+    parser.add_argument(
+        '--optimal',
+        action='store_true',
+        help='Compress to the smallest possible output (slower)'
+    )
+    
     args = parser.parse_args()
     
     # Normalize action
     action = 'compress' if args.action in ['c', 'compress'] else 'decompress'
     
-    # Read input
-    input_data = None
-    
-    if args.file:
-        if action == 'compress':
-            # For compression, read as text
-            with open(args.file, 'r', encoding='utf-8') as f:
-                input_data = f.read()
-        else:
-            # For decompression, read as binary
-            with open(args.file, 'rb') as f:
-                input_data = f.read()
-    elif args.input:
-        if action == 'compress':
-            input_data = args.input
-        else:
-            # For decompression from command line, assume hex or base64?
-            # Simpler: just treat as string and let decompress handle
-            input_data = args.input.encode('latin-1')
-    else:
-        # Read from stdin
-        if action == 'compress':
-            input_data = sys.stdin.read()
-        else:
-            input_data = sys.stdin.buffer.read()
-    
-    if input_data is None:
-        parser.error("No input provided")
+    # An existing regular output file is written to a temporary file next
+    # to it and only moved into place once processing succeeds, so a
+    # failure (or an output that is also the input) never truncates it
+    tmp_path = None
     
     try:
-        # Process
-        if action == 'compress':
-            result = compress(input_data)
-        else:  # decompress
-            result = decompress(input_data)
-        
-        # Output
-        if args.output:
-            if action == 'compress':
-                # Write compressed data as binary
-                with open(args.output, 'wb') as f:
-                    f.write(result)
+        with contextlib.ExitStack() as stack:
+            # Open input as a stream
+            if args.file:
+                if action == 'compress':
+                    # For compression, read as text
+                    fin = stack.enter_context(open(args.file, 'r', encoding='utf-8'))
+                else:
+                    # For decompression, read as binary
+                    fin = stack.enter_context(open(args.file, 'rb'))
+            elif args.input:
+                if action == 'compress':
+                    fin = io.StringIO(args.input)
+                else:
+                    # For decompression from command line, treat the
+                    # string as raw bytes and let decompress handle it
+                    fin = io.BytesIO(args.input.encode('latin-1'))
             else:
-                # Write decompressed data as text
-                with open(args.output, 'w', encoding='utf-8') as f:
-                    f.write(result.decode('utf-8'))
-        else:
-            if action == 'compress':
-                # For compressed output to stdout, use binary
-                sys.stdout.buffer.write(result)
+                # Read from stdin
+                fin = sys.stdin if action == 'compress' else sys.stdin.buffer
+            
+            # Output is written as binary, chunk by chunk
+            if args.output and _replaceable_file(args.output):
+                fd, tmp_path = tempfile.mkstemp(
+                    prefix='.smaz-',
+                    dir=os.path.dirname(os.path.abspath(args.output))
+                )
+                fout = stack.enter_context(os.fdopen(fd, 'wb'))
+            elif args.output:
+                # New files, symlinks, hard links, pipes and devices are
+                # written directly
+                fout = stack.enter_context(open(args.output, 'wb'))
             else:
-                # For decompressed output, print as text
-                print(result.decode('utf-8'))
+                fout = sys.stdout.buffer
+            
+            # Process
+            if action == 'compress':
+                compress_stream(fin, fout, optimal=args.optimal)
+            else:  # decompress
+                decompress_stream(fin, fout)
+                if not args.output:
+                    # End decompressed text on stdout with a newline
+                    fout.write(b'\n')
+        
+        if tmp_path:
+            os.chmod(tmp_path, os.stat(args.output).st_mode & 0o7777)
+            os.replace(tmp_path, args.output)
+            tmp_path = None
                 
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
 
 
 if __name__ == '__main__':